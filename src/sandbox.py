@@ -7,8 +7,9 @@ from sat_utils import from_dnf, from_dnf_with_de_morgan
 
 
 def assert_cnf_is_equivalent(cnf_1: List[Tuple[str]], cnf_2: List[Tuple[str]]):
+    # Order of clauses and of literals within a clause does not matter, and neither do duplicates of either
     msg = f'\ncnf 1: {cnf_1}\ncnf 2: {cnf_2}'
-    assert sorted([sorted(fact) for fact in cnf_1]) == sorted([sorted(fact) for fact in cnf_2]), msg
+    assert frozenset(map(frozenset, cnf_1)) == frozenset(map(frozenset, cnf_2)), msg
 
 
 def play_with_from_dnf():
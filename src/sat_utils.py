@@ -2,21 +2,36 @@
 Utility functions to humanize interaction with pycosat
 """
 
-from functools import lru_cache
+import operator
+from array import array
 from itertools import combinations
 from sys import intern
-from typing import List, Tuple, Collection
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Collection, Union
+from warnings import warn
 
 import pycosat  # https://pypi.python.org/pypi/pycosat
 
+# For a single solution, prefer a modern CDCL solver from python-sat if it is installed
+try:
+    from pysat.solvers import Cadical153 as _PySatSolver  # https://pypi.org/project/python-sat
+except ImportError:
+    try:
+        from pysat.solvers import Glucose4 as _PySatSolver
+    except ImportError:
+        _PySatSolver = None
+
 Fact = str
 Dnf = List[Tuple[Fact]]
 Cnf = List[Tuple[Fact]]
+NumberedCnf = List[Tuple[int, ...]]
 
 # Uses pseudo-namespacing to avoid collisions.
 _EXT_SUFFIX = "___"
 _NEXT_EXT_INDEX = 0
 
+# Above this number of elements, the sequential at-most-one encoding needs fewer clauses than the pairwise one
+_SEQUENTIAL_THRESHOLD = 5
+
 
 def is_ext_var(element: Fact) -> bool:
     return element.endswith(_EXT_SUFFIX)
@@ -30,25 +45,145 @@ def ext_var() -> Fact:
     return intern(f'{ext_index}{_EXT_SUFFIX}')
 
 
+class NumToVar:
+    """
+    Reverse lookup from PycoSat's numbers to symbolic literals
+
+    Only the variables are stored; negated literals are derived when they are looked up.
+    """
+
+    def __init__(self, lit2num: Dict[Fact, int]):
+        self._vars: List[Fact] = [''] + [literal for literal, num in lit2num.items() if num > 0]
+
+    def __getitem__(self, num: int) -> Fact:
+        var = self._vars[abs(num)]
+        return var if num > 0 else neg(var)
+
+    def __len__(self) -> int:
+        return 2 * (len(self._vars) - 1)
+
+
+def number_literal(literal: Fact, lit2num: Dict[Fact, int]) -> int:
+    """
+    Look up the number of a literal, and assign the next free number to its variable if it has none yet
+
+    >>> lit2num = {}
+    >>> number_literal('~a', lit2num), number_literal('b', lit2num), number_literal('a', lit2num)
+    (-1, 2, 1)
+    """
+
+    num = lit2num.get(literal)
+    if num is None:
+        var = intern(literal[1:] if literal[0] == '~' else literal)
+        var_num = len(lit2num) // 2 + 1
+        lit2num[var] = var_num
+        lit2num[intern('~' + var)] = -var_num
+        num = lit2num[literal]
+    return num
+
+
+def number_clause(clause: Iterable[Fact], lit2num: Dict[Fact, int]) -> Tuple[int, ...]:
+    """
+    Number the literals of a clause, assigning the next free numbers to variables that have none yet
+
+    >>> lit2num = {'a': 1, '~a': -1}
+    >>> number_clause(('~a',), lit2num), number_clause(('b', 'a'), lit2num)
+    ((-1,), (2, 1))
+    """
+
+    try:
+        # Nearly all literals are numbered already, so try a plain lookup first
+        return tuple(map(lit2num.__getitem__, clause))
+    except KeyError:
+        return tuple([number_literal(literal, lit2num) for literal in clause])
+
+
+class CnfBuilder:
+    """
+    Numbered cnf, stored as the literals of all clauses in one flat array plus the offsets where clauses start
+
+    Symbolic clauses that are added are numbered right away with the builder's own lit2num, so they
+    can be discarded immediately. This takes four bytes per literal and eight per clause, instead of a
+    Python object per clause and per literal. With uniquify, clauses that were added before (in any literal order) are
+    skipped, at the cost of keeping a set of all clauses.
+
+    >>> cnf = CnfBuilder()
+    >>> cnf += [('A', '~B'), ('B',)]
+    >>> cnf.extend([(-1, 3)])
+    >>> len(cnf), list(cnf), cnf.lit('C')
+    (3, [(1, -2), (2,), (-1, 3)], 3)
+    >>> cnf = CnfBuilder(uniquify=True)
+    >>> cnf += [('A', '~B'), ('~B', 'A')]
+    >>> list(cnf)
+    [(1, -2)]
+    """
+
+    def __init__(self, uniquify=False):
+        self.offsets = array('q', [0])
+        self.lits = array('i')
+        self.lit2num: Dict[Fact, int] = {}
+        self._seen: Optional[Set[Tuple[int, ...]]] = set() if uniquify else None
+
+    def lit(self, literal: Fact) -> int:
+        return number_literal(literal, self.lit2num)
+
+    def add(self, clause: Iterable[int]):
+        if self._seen is not None:
+            clause = tuple(clause)
+            key = tuple(sorted(clause))
+            if key in self._seen:
+                return
+            self._seen.add(key)
+        self.lits.extend(clause)
+        self.offsets.append(len(self.lits))
+
+    def extend(self, numbered_cnf: Iterable[Iterable[int]]):
+        if self._seen is not None:
+            for clause in numbered_cnf:
+                self.add(clause)
+            return
+
+        lits, offsets = self.lits, self.offsets
+        extend, append = lits.extend, offsets.append
+        for clause in numbered_cnf:
+            extend(clause)
+            append(len(lits))
+
+    def __iadd__(self, cnf: Cnf) -> 'CnfBuilder':
+        lit2num = self.lit2num
+        self.extend(number_clause(clause, lit2num) for clause in cnf)
+        return self
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def copy(self) -> 'CnfBuilder':
+        cnf = CnfBuilder()
+        cnf.offsets = self.offsets[:]
+        cnf.lits = self.lits[:]
+        cnf.lit2num = self.lit2num.copy()
+        cnf._seen = None if self._seen is None else self._seen.copy()
+        return cnf
+
+    def __iter__(self) -> Iterator[Tuple[int, ...]]:
+        lits = self.lits
+        for start, end in zip(self.offsets, self.offsets[1:]):
+            yield tuple(lits[start:end])
+
+
 def make_translate(cnf: Cnf):
     """
     Make translator from symbolic CNF to PycoSat's numbered clauses
 
     Return a literal to number dictionary and reverse lookup dict
 
-    >>> make_translate([('~a', 'b', '~c'), ('a', '~c')])
+    >>> make_translate([('~a', 'b', '~c'), ('a', '~c')])  # doctest: +NORMALIZE_WHITESPACE
     ({'a': 1, '~a': -1, 'b': 2, '~b': -2, 'c': 3, '~c': -3},
      {1: 'a', -1: '~a', 2: 'b', -2: '~b', 3: 'c', -3: '~c'})
     """
 
     lit2num = {}
-    for clause in cnf:
-        for literal in clause:
-            if literal not in lit2num:
-                var = literal[1:] if literal[0] == '~' else literal
-                num = len(lit2num) // 2 + 1
-                lit2num[intern(var)] = num
-                lit2num[intern('~' + var)] = -num
+    number_cnf(cnf, lit2num)
     num2var = {num: lit for lit, num in lit2num.items()}
     return lit2num, num2var
 
@@ -66,28 +201,163 @@ def translate(cnf: Cnf, uniquify=False):
     # http://people.sc.fsu.edu/~jburkardt/data/cnf/cnf.html
     if uniquify:
         cnf = list(dict.fromkeys(cnf))
-    lit2num, num2var = make_translate(cnf)
-    numbered_cnf = [tuple([lit2num[lit] for lit in clause]) for clause in cnf]
-    return numbered_cnf, num2var
+    lit2num = {}
+    numbered_cnf = number_cnf(cnf, lit2num)
+    return numbered_cnf, NumToVar(lit2num)
 
 
-def itersolve(symbolic_cnf: Cnf, include_neg=False):
-    numbered_cnf, num2var = translate(symbolic_cnf)
-    for solution in pycosat.itersolve(numbered_cnf):
+def number_cnf(cnf: Cnf, lit2num: Dict[Fact, int]) -> NumberedCnf:
+    """
+    Number the literals and the clauses in a single pass over the cnf
+
+    :param cnf: Symbolic cnf
+    :param lit2num: Literal to number dictionary, to which unnumbered literals are added
+    """
+
+    return [number_clause(clause, lit2num) for clause in cnf]
+
+
+def _numbered(cnf: Union[Cnf, CnfBuilder]) -> Tuple[Union[NumberedCnf, CnfBuilder], Dict[Fact, int]]:
+    if isinstance(cnf, CnfBuilder):
+        return cnf, cnf.lit2num
+    lit2num = {}
+    return number_cnf(cnf, lit2num), lit2num
+
+
+def itersolve(symbolic_cnf: Union[Cnf, CnfBuilder], include_neg=False, simplify=False):
+    numbered_cnf, lit2num = _numbered(symbolic_cnf)
+    return itersolve_numbered(numbered_cnf, lit2num, include_neg, simplify)
+
+
+def solve_all(symcnf: Union[Cnf, CnfBuilder], include_neg=False, simplify=False):
+    return list(itersolve(symcnf, include_neg, simplify))
+
+
+def solve_one(symcnf: Union[Cnf, CnfBuilder], include_neg=False, simplify=False):
+    """
+    Variables that no longer occur after preprocessing are still part of the solution, whichever solver is used
+
+    >>> solve_one([('A', 'B'), ('A',)], include_neg=True, simplify=True)
+    ['A', '~B']
+    """
+
+    numbered_cnf, lit2num = _numbered(symcnf)
+    return solve_one_numbered(numbered_cnf, lit2num, include_neg, simplify)
+
+
+def itersolve_numbered(numbered_cnf: Union[NumberedCnf, CnfBuilder], lit2num: Dict[Fact, int], include_neg=False,
+                       simplify=False):
+    """
+    Solve a cnf that is already numbered, e.g. with Q.to_numbered, and yield symbolic solutions
+
+    :param numbered_cnf: Clauses of PycoSat's numbers, as a list or a CnfBuilder
+    :param lit2num: Literal to number dictionary that was used to number the cnf
+    :param include_neg: Whether to include the literals that are false in the solutions
+    :param simplify: Whether to preprocess the cnf before handing it to PycoSat
+    """
+
+    num2var = NumToVar(lit2num)
+    if simplify:
+        numbered_cnf = preprocess(numbered_cnf)
+    # Variables that no longer occur after preprocessing must still be part of the solutions
+    for solution in pycosat.itersolve(numbered_cnf, vars=len(num2var) // 2):
         yield [num2var[n] for n in solution if include_neg or n > 0]
 
 
-def solve_all(symcnf: Cnf, include_neg=False):
-    return list(itersolve(symcnf, include_neg))
+def solve_one_numbered(numbered_cnf: Union[NumberedCnf, CnfBuilder], lit2num: Dict[Fact, int], include_neg=False,
+                       simplify=False):
+    if _PySatSolver is None:
+        return next(itersolve_numbered(numbered_cnf, lit2num, include_neg, simplify))
 
+    num2var = NumToVar(lit2num)
+    if simplify:
+        numbered_cnf = preprocess(numbered_cnf)
+    with _PySatSolver(bootstrap_with=numbered_cnf) as solver:
+        if not solver.solve():
+            # Same as when PycoSat's itersolve has no solutions
+            raise StopIteration
+        model = {abs(n): n for n in solver.get_model()}
+    # As with PycoSat's vars, variables that do not occur in the clauses are false
+    solution = [model.get(var, -var) for var in range(1, len(num2var) // 2 + 1)]
+    return [num2var[n] for n in solution if include_neg or n > 0]
 
-def solve_one(symcnf: Cnf, include_neg=False):
-    return next(itersolve(symcnf, include_neg))
+
+def preprocess(numbered_cnf: Iterable[Tuple[int, ...]]) -> NumberedCnf:
+    """
+    Simplify a numbered cnf with unit propagation and subsumption, keeping it equivalent
+
+    Clauses that are satisfied by a unit are dropped, and falsified literals are removed from the other
+    clauses, which may produce new units. The units themselves are kept as unit clauses. Of the remaining
+    clauses, the ones that are a superset of another clause are dropped.
+
+    >>> preprocess([(1,), (-1, 2, 3), (-2, 4), (2, 3), (3, 2, -4)])
+    [(1,), (2, 3), (-2, 4)]
+    >>> preprocess([(1, 2), (2, 1), (1, 2, 3)])
+    [(1, 2)]
+    >>> preprocess([(1,), (-1, 2), (-2,)])
+    [()]
+    >>> preprocess([(1, 2), ()])
+    [()]
+    """
+
+    clauses = [tuple(clause) for clause in numbered_cnf]
+    if not all(clauses):
+        # An empty clause can never be satisfied
+        return [()]
+    clauses_per_literal: Dict[int, List[int]] = {}
+    for index, clause in enumerate(clauses):
+        for literal in clause:
+            clauses_per_literal.setdefault(literal, []).append(index)
+
+    # Unit propagation
+    units = set()
+    queue = [clause[0] for clause in clauses if len(clause) == 1]
+    while queue:
+        unit = queue.pop()
+        if unit in units:
+            continue
+        if -unit in units:
+            return [()]
+        units.add(unit)
+        for index in clauses_per_literal.get(unit, ()):
+            clauses[index] = None
+        for index in clauses_per_literal.get(-unit, ()):
+            clause = clauses[index]
+            if clause is None:
+                continue
+            clause = tuple(literal for literal in clause if literal != -unit)
+            if not clause:
+                return [()]
+            if len(clause) == 1:
+                queue.append(clause[0])
+            clauses[index] = clause
+
+    # Subsumption: every clause drops the longer clauses that are a superset of it. Those all contain
+    # the literal of the clause with the fewest occurrences, so only the clauses with that literal are checked.
+    clauses = [clause for clause in clauses if clause is not None]
+    literal_sets = [frozenset(clause) for clause in clauses]
+    clauses_per_literal = {}
+    for index, literals in enumerate(literal_sets):
+        for literal in literals:
+            clauses_per_literal.setdefault(literal, []).append(index)
+    subsumed = [False] * len(clauses)
+    for index in sorted(range(len(clauses)), key=lambda i: len(literal_sets[i])):
+        if subsumed[index]:
+            continue
+        literals = literal_sets[index]
+        rarest_literal = min(literals, key=lambda literal: len(clauses_per_literal[literal]))
+        for other_index in clauses_per_literal[rarest_literal]:
+            if other_index != index and not subsumed[other_index] and literals <= literal_sets[other_index]:
+                subsumed[other_index] = True
+
+    return [(unit,) for unit in units] + [clause for clause, is_subsumed in zip(clauses, subsumed) if not is_subsumed]
 
 
 ############### Support for Building CNFs ##########################
 
-@lru_cache(maxsize=None)
+_NEGATIONS: Dict[Fact, Fact] = {}
+
+
 def neg(element: Fact) -> Fact:
     """
     Negate a single element
@@ -98,7 +368,13 @@ def neg(element: Fact) -> Fact:
     'A'
     """
 
-    return intern(element[1:] if element.startswith('~') else '~' + element)
+    # A plain dict is cheaper than lru_cache, and storing both directions saves the reverse lookup
+    negation = _NEGATIONS.get(element)
+    if negation is None:
+        negation = intern(element[1:] if element[0] == '~' else '~' + element)
+        _NEGATIONS[element] = negation
+        _NEGATIONS[negation] = intern(element)
+    return negation
 
 
 def from_dnf_with_de_morgan(groups: Dnf) -> Cnf:
@@ -113,21 +389,57 @@ def from_dnf_with_de_morgan(groups: Dnf) -> Cnf:
              [ ('A', 'D', 'G'), ('A', 'D', 'H'), ..., ('C', 'F', 'H'), ('C', 'F', 'I') ]
                  means
              (A or D or G) and (A or D or H) and ... and (C or F or H) and (C or F or I)
+
+    Deprecated: the output grows as the product of the group sizes. Use from_dnf instead.
     """
 
-    cnf = {frozenset()}
-    for group_index, group in enumerate(groups, start=1):
-        nl = {frozenset([literal]): neg(literal) for literal in group}
+    warn('from_dnf_with_de_morgan is deprecated, use from_dnf instead', DeprecationWarning, stacklevel=2)
+
+    # Every variable gets its own bit, and a clause is a pair of bitmasks: one for the
+    # variables that occur positively, and one for the variables that occur negated.
+    var_bits: Dict[Fact, int] = {}
+    literal_masks: Dict[Fact, Tuple[int, int]] = {}
+    for group in groups:
+        for literal in group:
+            if literal not in literal_masks:
+                var = literal[1:] if literal[0] == '~' else literal
+                bit = var_bits.setdefault(var, 1 << len(var_bits))
+                literal_masks[literal] = (0, bit) if literal[0] == '~' else (bit, 0)
+
+    # AND and OR are commutative, and multiplying out the smallest groups first keeps the
+    # intermediate cnfs small, since subsumed clauses are removed before they are multiplied.
+    cnf = {(0, 0)}
+    for group in sorted(groups, key=len):
+        nl = {literal_masks[literal] for literal in group}
         # The "clause | literal" prevents dup lits: {x, x, y} -> {x, y}
         # The nl check skips over identities: {x, ~x, y} -> True
-        cnf = {clause | literal for literal in nl for clause in cnf
-               if nl[literal] not in clause}
-        # The sc check removes clauses with superfluous terms:
-        #     {{x}, {x, z}, {y, z}} -> {{x}, {y, z}}
-        # Should this be left until the end?
-        sc = min(cnf, key=len)  # XXX not deterministic
-        cnf -= {clause for clause in cnf if clause > sc}
-    return list(map(tuple, cnf))
+        cnf = {(pos | lit_pos, negs | lit_neg) for lit_pos, lit_neg in nl for pos, negs in cnf
+               if not (pos & lit_neg or negs & lit_pos)}
+        # Remove all clauses with superfluous terms: {{x}, {x, z}, {y, z}} -> {{x}, {y, z}}
+        cnf = _minimal_clauses(cnf)
+
+    bit_vars = [(bit, var) for var, bit in var_bits.items()]
+    return [
+        tuple(var for bit, var in bit_vars if pos & bit) + tuple(neg(var) for bit, var in bit_vars if negs & bit)
+        for pos, negs in cnf
+    ]
+
+
+def _minimal_clauses(cnf: Set[Tuple[int, int]]) -> Set[Tuple[int, int]]:
+    """
+    Remove the clauses that are a superset of another clause, for clauses as pairs of bitmasks
+    """
+
+    sizes = {clause: clause[0].bit_count() + clause[1].bit_count() for clause in cnf}
+    if len(set(sizes.values())) <= 1:
+        # Different clauses of the same size are never a subset of each other
+        return cnf
+
+    minimal = []
+    for pos, negs in sorted(cnf, key=sizes.__getitem__):
+        if not any(pos & min_pos == min_pos and negs & min_neg == min_neg for min_pos, min_neg in minimal):
+            minimal.append((pos, negs))
+    return set(minimal)
 
 
 def from_dnf(groups) -> Cnf:
@@ -154,25 +466,82 @@ def from_dnf(groups) -> Cnf:
              0 = (A and B and C), 1 = (D and E and F), 2 = (G and H and I)
     """
 
+    return _from_dnf(groups, neg, ext_var)
+
+
+def _from_dnf(groups, negate: Callable, new_var: Callable, imply_ext: bool = True) -> list:
+    """
+    Tseytin transformation of from_dnf, for literals that are negated and extended with the given functions
+
+    Without imply_ext, only the implications from the extension variables to their groups are added.
+    """
+
     cnf = []
 
     extension_vars = []
     for group in groups:
-        extension_var = ext_var()
-        neg_extension_var = neg(extension_var)
+        extension_var = new_var()
+        neg_extension_var = negate(extension_var)
 
-        imply_ext_clause = []
         for literal in group:
-            imply_ext_clause.append(neg(literal))
             cnf.append((neg_extension_var, literal))  # ('~0___', 'A')
-        imply_ext_clause.append(extension_var)
-        cnf.append(tuple(imply_ext_clause))  # ('~A', '~B', '~C', '0___')
+        if imply_ext:
+            cnf.append(tuple(map(negate, group)) + (extension_var,))  # ('~A', '~B', '~C', '0___')
         extension_vars.append(extension_var)
 
     cnf.append(tuple(extension_vars))  # ('0___', '1___', '2___')
     return cnf
 
 
+def from_numbered_dnf_by_prefix(groups: NumberedCnf, lit2num: Dict[Fact, int]) -> NumberedCnf:
+    """
+    Convert from or-of-ands to and-of-ors, equisatisfiably, sharing the first literal of the groups
+
+    The groups are grouped by their first literal, so that
+        (A and B and C) or (A and D and E) or (F and G and H)
+    is encoded as
+        (A and ((B and C) or (D and E))) or (F and (G and H))
+    Every prefix gets its own extension variable, and so does every tail, as in from_dnf.
+
+    The literals are numbered already, which skips building, negating and numbering a string for
+    every literal of the many groups of the lines of a towers puzzle. Also, only the implications
+    from the extension variables to their groups are added: the groups only occur positively, so the
+    clauses for the other direction (the longest ones) are not needed to keep the cnf equisatisfiable.
+    As a consequence, the extension variables are not fixed by the other variables, so use this for
+    finding a solution, not for enumerating or counting all of them.
+
+    >>> lit2num = {'A': 1, '~A': -1, 'B': 2, '~B': -2, 'C': 3, '~C': -3}
+    >>> from_numbered_dnf_by_prefix([(1, 2), (1, 3), (-1, 2)], lit2num)
+    [(-5, 2), (-6, 3), (-4, 1), (-4, 5, 6), (-8, 2), (-7, -1), (-7, 8), (4, 7)]
+
+    :param groups: A list of tuples of numbers, where each tuple is an AND, and the list is an OR
+    :param lit2num: Literal to number dictionary, to which the extension variables are added
+    :return: A list of tuples of numbers, where each tuple is an OR, and the list is an AND
+    """
+
+    def new_var() -> int:
+        return number_literal(ext_var(), lit2num)
+
+    tails_per_prefix: Dict[int, NumberedCnf] = {}
+    for group in groups:
+        tails_per_prefix.setdefault(group[0], []).append(group[1:])
+
+    cnf = []
+
+    extension_vars = []
+    for prefix, tails in tails_per_prefix.items():
+        extension_var = new_var()
+
+        *tails_cnf, tails_clause = _from_dnf(tails, operator.neg, new_var, imply_ext=False)
+        cnf += tails_cnf
+        cnf.append((-extension_var, prefix))  # ('~0___', 'A')
+        cnf.append((-extension_var,) + tails_clause)  # ('~0___', '1___', '2___')
+        extension_vars.append(extension_var)
+
+    cnf.append(tuple(extension_vars))
+    return cnf
+
+
 class Q:
     """
     Quantifier for the number of elements that are true
@@ -181,6 +550,29 @@ class Q:
     def __init__(self, elements: Collection[Fact]):
         self.elements = tuple(elements)
 
+    @staticmethod
+    def _neg(element: Fact) -> Fact:
+        return neg(element)
+
+    @staticmethod
+    def _ext_var() -> Fact:
+        return ext_var()
+
+    def to_numbered(self, lit2num: Dict[Fact, int]) -> 'NumberedQ':
+        """
+        Quantifier over the numbers of the elements, of which the clauses are numbered already
+
+        >>> lit2num = {}
+        >>> Q(['A', 'B']).to_numbered(lit2num) == 1
+        [(-1, -2), (1, 2)]
+        >>> lit2num
+        {'A': 1, '~A': -1, 'B': 2, '~B': -2}
+
+        :param lit2num: Literal to number dictionary, to which unnumbered elements are added
+        """
+
+        return NumberedQ([number_literal(element, lit2num) for element in self.elements], lit2num)
+
     def __lt__(self, n: int) -> Cnf:
         """
         >>> q = Q(['A', 'B'])
@@ -193,9 +585,40 @@ class Q:
         :return: Conjunctive normal form of facts such that the above statement holds
         """
 
-        return list(combinations(map(neg, self.elements), n))
+        return list(combinations(map(self._neg, self.elements), n))
+
+    def _at_most_one_sequential(self) -> Cnf:
+        """
+        At most one of the elements is true, with the sequential encoding of Sinz
+
+        Extension variable s_i means that one of the first i elements is true. This takes 3n - 4
+        clauses instead of the n (n - 1) / 2 clauses of the pairwise encoding.
+        http://www.carstensinz.de/papers/CP-2005.pdf
+
+        The s_i are only implied in one direction, so they are only fixed by the solution if at least one
+        of the elements is true. Otherwise every solution would be repeated for each monotone pattern of
+        the s_i, so this is only used for exactly one.
+        """
+
+        cnf = []
+        *elements, last_element = self.elements
+        seen_var = None
+        for element in elements:
+            next_seen_var = self._ext_var()
+            cnf.append((self._neg(element), next_seen_var))  # x_i -> s_i
+            if seen_var is not None:
+                cnf.append((self._neg(seen_var), next_seen_var))  # s_i-1 -> s_i
+                cnf.append((self._neg(element), self._neg(seen_var)))  # x_i -> ~s_i-1
+            seen_var = next_seen_var
+        cnf.append((self._neg(last_element), self._neg(seen_var)))  # x_n -> ~s_n-1
+        return cnf
 
     def __le__(self, n: int) -> Cnf:
+        """
+        >>> len(solve_all(Q(['A', 'B', 'C', 'D', 'E', 'F']) <= 1))
+        7
+        """
+
         return self < n + 1
 
     def __gt__(self, n: int) -> Cnf:
@@ -216,6 +639,9 @@ class Q:
         return self > n - 1
 
     def __eq__(self, n: int) -> Cnf:
+        if n == 1 and len(self.elements) > _SEQUENTIAL_THRESHOLD:
+            # With the at-least-one clause, the extension variables of the sequential encoding are fixed
+            return self._at_most_one_sequential() + (self >= 1)
         return (self <= n) + (self >= n)
 
     def __ne__(self, n) -> Cnf:
@@ -230,6 +656,25 @@ class Q:
         return f'{self.__class__.__name__}(elements={self.elements!r})'
 
 
+class NumberedQ(Q):
+    """
+    Quantifier for the number of elements that are true, with elements and clauses in PycoSat's numbers
+
+    This skips numbering the clauses afterwards, which matters for the many clauses of one_of.
+    """
+
+    def __init__(self, elements: Collection[int], lit2num: Dict[Fact, int]):
+        super().__init__(elements)
+        self._lit2num = lit2num
+
+    @staticmethod
+    def _neg(element: int) -> int:
+        return -element
+
+    def _ext_var(self) -> int:
+        return number_literal(ext_var(), self._lit2num)
+
+
 def all_of(elements: List[Fact]) -> Cnf:
     """
     Forces inclusion of matching rows on a truth table
@@ -249,6 +694,14 @@ def some_of(elements: List[Fact]) -> Cnf:
 def one_of(elements: List[Fact]) -> Cnf:
     """
     Exactly one of the elements is true
+
+    Small groups use the pairwise at-most-one encoding, larger groups the sequential (ladder) one,
+    whichever takes fewer clauses; see Q.__eq__.
+
+    >>> len(one_of(['A', 'B', 'C', 'D'])), len(one_of(['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']))
+    (7, 21)
+    >>> len(solve_all(one_of(['A', 'B', 'C', 'D', 'E', 'F'])))
+    6
     """
 
     return Q(elements) == 1
@@ -1,11 +1,12 @@
 """
 https://rhettinger.github.io/einstein.html#sudoku-puzzles
 """
+from functools import lru_cache
 from typing import List
 
 from sys import intern
 
-from sat_utils import basic_fact, one_of, solve_one
+from sat_utils import CnfBuilder, Q, basic_fact, is_ext_var, solve_one
 
 n = 3
 
@@ -47,6 +48,10 @@ def comb(point: str, value: int) -> str:
     return intern(f'{point} {value}')
 
 
+comb_table = {point: {value: comb(point, value) for value in values} for point in points}
+point_index = {point: index for index, point in enumerate(points)}
+
+
 def str_to_facts(s) -> List[str]:
     """
     Convert str in row major form to a list of facts
@@ -59,7 +64,7 @@ def str_to_facts(s) -> List[str]:
     'GB 6', 'IA 2', 'IB 8', 'HD 4', 'HE 1', 'HF 9', 'IF 5', 'HH 8', 'IH 7', 'II 9']
     """
 
-    return [comb(point, value) for point, value in zip(points, s) if
+    return [comb_table[point][value] for point, value in zip(points, s) if
             value != ' ']
 
 
@@ -71,8 +76,12 @@ def facts_to_str(facts: List[str]) -> str:
     :return: Sudoku string representation
     """
 
-    point_to_value = dict(map(str.split, facts))
-    return ''.join(point_to_value.get(point, ' ') for point in points)
+    flatline = bytearray(b' ' * len(points))
+    for fact in facts:
+        if not is_ext_var(fact):
+            point, value = fact.split()
+            flatline[point_index[point]] = ord(value)
+    return flatline.decode()
 
 
 def show(flatline):
@@ -82,33 +91,46 @@ def show(flatline):
     :param flatline: Sudoku string representation
     """
 
-    fmt = '|'.join(['%s' * n] * n)
+    row_size = n ** 2
     sep = '+'.join(['-' * n] * n)
-    for i in range(n):
-        for j in range(n):
-            offset = (i * n + j) * n ** 2
-            print(fmt % tuple(flatline[offset:offset + n ** 2]))
-        if i != n - 1:
-            print(sep)
+    lines = []
+    for offset in range(0, row_size ** 2, row_size):
+        if offset and offset % (n * row_size) == 0:
+            lines.append(sep)
+        lines.append('|'.join(flatline[start:start + n] for start in range(offset, offset + row_size, n)))
+    print('\n'.join(lines))
 
 
-def solve(puzzle):
+@lru_cache(maxsize=None)
+def rules() -> CnfBuilder:
     """
-    Solve the given puzzle
+    Numbered clauses of the sudoku rules, built only once for all puzzles
 
-    :param puzzle: Sudoku string representation
+    The returned cnf is shared, so copy it before extending it.
     """
 
-    cnf = []
+    cnf = CnfBuilder()
 
     # each point assigned exactly one value
     for point in points:
-        cnf += one_of(comb(point, value) for value in values)
+        cnf.extend(Q(comb_table[point].values()).to_numbered(cnf.lit2num) == 1)
 
     # each value gets assigned to exactly one point in each group
     for group in groups:
         for value in values:
-            cnf += one_of(comb(point, value) for point in group)
+            cnf.extend(Q([comb_table[point][value] for point in group]).to_numbered(cnf.lit2num) == 1)
+
+    return cnf
+
+
+def solve(puzzle):
+    """
+    Solve the given puzzle
+
+    :param puzzle: Sudoku string representation
+    """
+
+    cnf = rules().copy()
 
     # add facts for known values in a specific puzzle
     for known in str_to_facts(puzzle):
@@ -2,10 +2,12 @@ import string
 
 import itertools
 from enum import Enum
+from functools import cached_property, lru_cache
+from operator import getitem, itemgetter
 from sys import intern
-from typing import Collection, Dict, List
+from typing import Collection, Dict, Iterator, List, Optional, Sequence, Tuple
 
-from sat_utils import basic_fact, from_dnf, one_of, solve_one, is_ext_var
+from sat_utils import CnfBuilder, NumberedCnf, Q, basic_fact, from_numbered_dnf_by_prefix, is_ext_var, solve_one
 
 Point = str
 
@@ -29,7 +31,7 @@ def comb(point: Point, value: int) -> str:
     return intern(f'{point} {value}')
 
 
-def visible_from_line(line: Collection[int], reverse: bool = False) -> int:
+def visible_from_line(line: Sequence[int], reverse: bool = False) -> int:
     """
     Return how many towers are visible from the given line
 
@@ -37,10 +39,11 @@ def visible_from_line(line: Collection[int], reverse: bool = False) -> int:
     4
     >>> visible_from_line([1, 4, 3, 2])
     2
+    >>> visible_from_line([1, 4, 3, 2], reverse=True)
+    3
     """
 
-    visible = 0
-    highest_seen = 0
+    visible = highest_seen = 0
     for number in reversed(line) if reverse else line:
         if number > highest_seen:
             visible += 1
@@ -48,6 +51,216 @@ def visible_from_line(line: Collection[int], reverse: bool = False) -> int:
     return visible
 
 
+def perms_with_visibility(n: int, k: int) -> Iterator[Tuple[int, ...]]:
+    """
+    Yield all permutations of 1..n of which exactly k towers are visible from the start of the line
+
+    The highest tower n is always visible, and hides all towers after it. So the towers before it
+    are a permutation of a subset of the remaining values with k - 1 visible towers, and the
+    towers after it are any permutation of the other values.
+
+    >>> sorted(perms_with_visibility(3, 2))
+    [(1, 3, 2), (2, 1, 3), (2, 3, 1)]
+    >>> list(perms_with_visibility(4, 4))
+    [(1, 2, 3, 4)]
+    """
+
+    return map(tuple, _perms_with_visibility(bytes(range(1, n + 1)), k))
+
+
+@lru_cache(maxsize=None)
+def _perms_with_visibility(values: bytes, k: int) -> Tuple[bytes, ...]:
+    """
+    :return: All permutations of the values with k visible towers, shared by all recursive calls that need them.
+             A permutation is stored as bytes, which takes a third of the memory of a tuple of the values.
+    """
+
+    if not values:
+        return (b'',) if k == 0 else ()
+    if not 1 <= k <= len(values):
+        return ()
+
+    perms = []
+    lower_values, highest = values[:-1], values[-1:]
+    for nr_before in range(k - 1, len(lower_values) + 1):
+        for values_before in itertools.combinations(lower_values, nr_before):
+            befores = _perms_with_visibility(bytes(values_before), k - 1)
+            if not befores:
+                continue
+            afters = list(map(bytes, itertools.permutations(value for value in lower_values
+                                                            if value not in values_before)))
+            for before in befores:
+                before += highest
+                perms += [before + after for after in afters]
+    return tuple(perms)
+
+
+def perms_with_visibilities(n: int, k_start: int, k_end: int) -> Iterator[Tuple[int, ...]]:
+    """
+    Yield all permutations of 1..n with k_start towers visible from the start and k_end from the end
+
+    The highest tower n is visible from both ends and splits the line: the towers before it take care
+    of the other k_start - 1 visible from the start, the towers after it of the other k_end - 1
+    visible from the end. So no permutations need to be filtered.
+
+    >>> sorted(perms_with_visibilities(4, 2, 2))
+    [(1, 4, 2, 3), (2, 1, 4, 3), (2, 4, 1, 3), (3, 1, 4, 2), (3, 2, 4, 1), (3, 4, 1, 2)]
+    >>> list(perms_with_visibilities(4, -1, 2)), list(perms_with_visibilities(4, 2, 5))
+    ([], [])
+    """
+
+    return map(tuple, _perms_with_visibilities(n, k_start, k_end))
+
+
+def _perms_with_visibilities(n: int, k_start: int, k_end: int) -> Iterator[bytes]:
+    if not (1 <= k_start <= n and 1 <= k_end <= n):
+        return
+
+    values = bytes(range(1, n + 1))
+    lower_values, highest = values[:-1], values[-1:]
+    for nr_before in range(k_start - 1, len(lower_values) - (k_end - 1) + 1):
+        for values_before in itertools.combinations(lower_values, nr_before):
+            befores = _perms_with_visibility(bytes(values_before), k_start - 1)
+            if not befores:
+                continue
+            values_after = bytes(value for value in lower_values if value not in values_before)
+            afters = [after[::-1] for after in _perms_with_visibility(values_after, k_end - 1)]
+            for before in befores:
+                before += highest
+                for after in afters:
+                    yield before + after
+
+
+@lru_cache(maxsize=None)
+def _perms(n: int, visible_from_start: int, visible_from_end: Optional[int] = None) -> Tuple[bytes, ...]:
+    """
+    :param n: Size of the grid
+    :param visible_from_start: Number of towers that must be visible from the start of the line
+    :param visible_from_end: Number of towers that must be visible from the end of the line, if given
+    :return: All permutations with these numbers of visible towers, shared by all lines of all puzzles of size n
+    """
+
+    if visible_from_end is None:
+        return _perms_with_visibility(bytes(range(1, n + 1)), visible_from_start)
+    return tuple(_perms_with_visibilities(n, visible_from_start, visible_from_end))
+
+
+@lru_cache(maxsize=None)
+def _grid(n: int) -> Tuple[List[List[Point]], List[List[Point]], Dict[Point, List[str]]]:
+    """
+    :param n: Size of the grid
+    :return: Points per row, points per column, and the facts per point indexed by value - 1
+    """
+
+    letters = string.ascii_uppercase[:n]
+    rows = [[row_letter + col_letter for col_letter in letters] for row_letter in letters]
+    cols = [list(col) for col in zip(*rows)]
+    facts = {point: [comb(point, value) for value in range(1, n + 1)] for row in rows for point in row}
+    return rows, cols, facts
+
+
+@lru_cache(maxsize=None)
+def _latin_square_cnf(n: int) -> CnfBuilder:
+    """
+    Numbered clauses that do not depend on the clues, so that they are built only once per grid size
+
+    Each point gets exactly one value, and each value occurs exactly once in each row and column.
+    The returned cnf is shared, so copy it before extending it.
+    """
+
+    rows, cols, facts = _grid(n)
+
+    cnf = CnfBuilder()
+    for row in rows:
+        for point in row:
+            cnf.extend(Q(facts[point]).to_numbered(cnf.lit2num) == 1)
+    for line in rows + cols:
+        for index in range(n):
+            cnf.extend(Q([facts[point][index] for point in line]).to_numbered(cnf.lit2num) == 1)
+    return cnf
+
+
+@lru_cache(maxsize=8)
+def _puzzle_cnf(visible_from_top: Tuple[Optional[int], ...], visible_from_bottom: Tuple[Optional[int], ...],
+                visible_from_left: Tuple[Optional[int], ...], visible_from_right: Tuple[Optional[int], ...],
+                given_numbers: Tuple[Tuple[Point, int], ...]) -> CnfBuilder:
+    """
+    Numbered clauses of a puzzle, so that puzzles with the same clues build them only once
+
+    The returned cnf is shared, so copy it before extending it.
+    """
+
+    n = len(visible_from_top)
+    rows, cols, facts = _grid(n)
+    given = dict(given_numbers)
+
+    cnf = _latin_square_cnf(n).copy()
+
+    # Set visible from left and right of the rows, and from top and bottom of the columns
+    lines = zip(rows + cols, visible_from_left + visible_from_top, visible_from_right + visible_from_bottom)
+    for line, visible_from_start, visible_from_end in lines:
+        cnf.extend(_visibility_cnf(cnf, line, visible_from_start, visible_from_end, given))
+
+    # Set given numbers
+    for point, value in given_numbers:
+        cnf += basic_fact(facts[point][value - 1])
+
+    return cnf
+
+
+def _visibility_cnf(cnf: CnfBuilder, line: List[Point], visible_from_start: Optional[int],
+                    visible_from_end: Optional[int], given_numbers: Dict[Point, int]) -> NumberedCnf:
+    """
+    :param cnf: Cnf of the puzzle, of which the numbers of the facts are used
+    :param line: Points on a row or column
+    :param visible_from_start: Number of towers that must be visible from the start of the line, if given
+    :param visible_from_end: Number of towers that must be visible from the end of the line, if given
+    :param given_numbers: Given values of points of the puzzle
+    :return: Numbered clauses that restrict the line to the permutations with these numbers of visible towers
+    """
+
+    n = len(line)
+    if visible_from_start and visible_from_end:
+        perms = _perms(n, visible_from_start, visible_from_end)
+    elif visible_from_start or visible_from_end:
+        if not visible_from_start:
+            line = line[::-1]
+        visible = visible_from_start or visible_from_end
+        if visible == 1:
+            # Only the highest tower is visible, so it stands at the start
+            return [(cnf.lit(comb(line[0], n)),)]
+        perms = _perms(n, visible)
+    else:
+        return []
+
+    # Keep the permutations that agree with the given numbers on the line
+    given = [(index, given_numbers[point]) for index, point in enumerate(line) if point in given_numbers]
+    if given:
+        indices, values = zip(*given)
+        if len(values) == 1:
+            # For a single index, itemgetter returns the value itself instead of a tuple
+            values = values[0]
+        values_at = itemgetter(*indices)
+        perms = [perm for perm in perms if values_at(perm) == values]
+    if len(perms) == 1:
+        return [(num,) for num in _line_dnf(cnf, line, perms)[0]]
+    return from_numbered_dnf_by_prefix(_line_dnf(cnf, line, perms), cnf.lit2num)
+
+
+def _line_dnf(cnf: CnfBuilder, line: List[Point], perms: Collection[bytes]) -> NumberedCnf:
+    """
+    :param cnf: Cnf of the puzzle, of which the numbers of the facts are used
+    :param line: Points on a row or column
+    :param perms: Permutations of the values on the line
+    :return: Numbered facts of these permutations on the line
+    """
+
+    facts = _grid(len(line))[2]
+    # Index 0 is never used, since the values start at 1
+    nums = [[0] + [cnf.lit(fact) for fact in facts[point]] for point in line]
+    return [tuple(map(getitem, nums, perm)) for perm in perms]
+
+
 class TowersPuzzle:
     def __init__(self, grid_size: int = 4, level: Level = Level.easy):
         self._set_puzzle(grid_size, level)
@@ -101,16 +314,14 @@ class TowersPuzzle:
 
     def display_solution(self):
         print('*** Solution ***')
-        # point_to_value = {point: value for point, value in [fact.split() for fact in self.solution]}
-        point_to_value = {
-            point: value
-            for point, value in [
-                fact.split() for fact in self.solution if not is_ext_var(fact)
-            ]
-        }
+        point_to_value = {}
+        for fact in self.solution:
+            if not is_ext_var(fact):
+                point, _, value = fact.partition(' ')
+                point_to_value[point] = value
         self._display(point_to_value)
 
-    @property
+    @cached_property
     def n(self) -> int:
         """
         :return: Size of the grid
@@ -118,11 +329,12 @@ class TowersPuzzle:
 
         return len(self.visible_from_top)
 
-    @property
+    @cached_property
     def points(self) -> List[Point]:
-        return [''.join(letters) for letters in itertools.product(string.ascii_uppercase[:self.n], repeat=2)]
+        letters = string.ascii_uppercase[:self.n]
+        return [row_letter + col_letter for row_letter in letters for col_letter in letters]
 
-    @property
+    @cached_property
     def rows(self) -> List[List[Point]]:
         """
         :return: Points, grouped per row
@@ -130,7 +342,7 @@ class TowersPuzzle:
 
         return [self.points[i:i + self.n] for i in range(0, self.n * self.n, self.n)]
 
-    @property
+    @cached_property
     def cols(self) -> List[List[Point]]:
         """
         :return: Points, grouped per column
@@ -138,94 +350,17 @@ class TowersPuzzle:
 
         return [self.points[i::self.n] for i in range(self.n)]
 
-    @property
+    @cached_property
     def values(self) -> List[int]:
         return list(range(1, self.n + 1))
 
     @property
-    def cnf(self):
+    def cnf(self) -> CnfBuilder:
         if self._cnf is None:
-            cnf = []
-
-            # Each point assigned exactly one value
-            for point in self.points:
-                cnf += one_of(comb(point, value) for value in self.values)
-
-            # Each value gets assigned to exactly one point in each row
-            for row in self.rows:
-                for value in self.values:
-                    cnf += one_of(comb(point, value) for point in row)
-
-            # Each value gets assigned to exactly one point in each col
-            for col in self.cols:
-                for value in self.values:
-                    cnf += one_of(comb(point, value) for point in col)
-
-            # Set visible from left
-            if self.visible_from_left:
-                for index, row in enumerate(self.rows):
-                    target_visible = self.visible_from_left[index]
-                    if not target_visible:
-                        continue
-                    possible_perms = []
-                    for perm in itertools.permutations(range(1, self.n + 1)):
-                        if visible_from_line(perm) == target_visible:
-                            possible_perms.append(tuple(
-                                comb(point, value)
-                                for point, value in zip(row, perm)
-                            ))
-                    cnf += from_dnf(possible_perms)
-
-            # Set visible from right
-            if self.visible_from_right:
-                for index, row in enumerate(self.rows):
-                    target_visible = self.visible_from_right[index]
-                    if not target_visible:
-                        continue
-                    possible_perms = []
-                    for perm in itertools.permutations(range(1, self.n + 1)):
-                        if visible_from_line(perm, reverse=True) == target_visible:
-                            possible_perms.append(tuple(
-                                comb(point, value)
-                                for point, value in zip(row, perm)
-                            ))
-                    cnf += from_dnf(possible_perms)
-
-            # Set visible from top
-            if self.visible_from_top:
-                for index, col in enumerate(self.cols):
-                    target_visible = self.visible_from_top[index]
-                    if not target_visible:
-                        continue
-                    possible_perms = []
-                    for perm in itertools.permutations(range(1, self.n + 1)):
-                        if visible_from_line(perm) == target_visible:
-                            possible_perms.append(tuple(
-                                comb(point, value)
-                                for point, value in zip(col, perm)
-                            ))
-                    cnf += from_dnf(possible_perms)
-
-            # Set visible from bottom
-            if self.visible_from_bottom:
-                for index, col in enumerate(self.cols):
-                    target_visible = self.visible_from_bottom[index]
-                    if not target_visible:
-                        continue
-                    possible_perms = []
-                    for perm in itertools.permutations(range(1, self.n + 1)):
-                        if visible_from_line(perm, reverse=True) == target_visible:
-                            possible_perms.append(tuple(
-                                comb(point, value)
-                                for point, value in zip(col, perm)
-                            ))
-                    cnf += from_dnf(possible_perms)
-
-            # Set given numbers
-            for point, value in self.given_numbers.items():
-                cnf += basic_fact(comb(point, value))
-
-            self._cnf = cnf
+            cnf = _puzzle_cnf(tuple(self.visible_from_top), tuple(self.visible_from_bottom),
+                              tuple(self.visible_from_left), tuple(self.visible_from_right),
+                              tuple(sorted(self.given_numbers.items())))
+            self._cnf = cnf.copy()
 
         return self._cnf
 